@@ -0,0 +1,185 @@
+# benchmarks/index_sweep.py
+"""Sweeps vector index settings and reports recall@k against exact search, query latency and index memory.
+
+Every combination of distance metric, M, construction_ef and search_ef is built in an in-process
+ChromaDB client over the same precomputed embeddings. Recall@k is the overlap between the ANN
+top-k and the exact brute-force top-k. If the query file has a `relevant_id` column, hit@k of the
+ANN results against those labels is reported too.
+
+Memory is reported twice. `rss_delta_mb` is the measured growth of the process; a throwaway index is
+built first so one-time initialization is not counted, but allocator reuse still makes it
+approximate. `est_index_mb` is the hnswlib size estimate and is the column to compare between settings.
+
+Usage:
+    PYTHONPATH=src python benchmarks/index_sweep.py --queries queries.csv --k 5 \\
+        --space cosine --m 8 16 32 --construction-ef 64 128 --search-ef 10 50 100
+
+    # Without the embedding model: random corpus and queries
+    PYTHONPATH=src python benchmarks/index_sweep.py --synthetic 20000 --dim 384
+"""
+import argparse
+import gc
+import itertools
+import os
+import statistics
+import time
+import uuid
+
+import chromadb
+import numpy as np
+import pandas as pd
+
+from kf_rag_wowinfo.utils import INDEX_SPACES, build_index_metadata
+
+EMBEDDING_MODEL = "all-MiniLM-L6-v2"
+ADD_BATCH_SIZE = 5000
+
+
+def load_corpus(args):
+    """Returns (ids, corpus embeddings, query embeddings, relevant ids or None)."""
+    if args.synthetic:
+        rng = np.random.default_rng(0)
+        corpus = rng.standard_normal((args.synthetic, args.dim)).astype(np.float32)
+        queries = rng.standard_normal((args.num_queries, args.dim)).astype(np.float32)
+        return [str(i) for i in range(len(corpus))], corpus, queries, None
+
+    from sentence_transformers import SentenceTransformer
+
+    model = SentenceTransformer(EMBEDDING_MODEL)
+    df = pd.read_csv(args.csv_path)
+    ids = [f"{row['class']}-{row['spec']}" for _, row in df.iterrows()]
+    corpus = model.encode(df["description"].tolist(), convert_to_numpy=True).astype(np.float32)
+
+    if args.queries:
+        queries_df = pd.read_csv(args.queries)
+        query_texts = queries_df["query"].tolist()
+        relevant = queries_df["relevant_id"].tolist() if "relevant_id" in queries_df else None
+    else:
+        # No labeled set: use the corpus itself as queries
+        query_texts, relevant = df["description"].tolist(), None
+    queries = model.encode(query_texts, convert_to_numpy=True).astype(np.float32)
+    return ids, corpus, queries, relevant
+
+
+def exact_top_k(corpus, queries, space, k):
+    """Brute-force top-k indices using the same distance definitions as ChromaDB."""
+    if space == "cosine":
+        corpus = corpus / np.linalg.norm(corpus, axis=1, keepdims=True)
+        queries = queries / np.linalg.norm(queries, axis=1, keepdims=True)
+        distances = 1.0 - queries @ corpus.T
+    elif space == "ip":
+        distances = 1.0 - queries @ corpus.T
+    else:
+        distances = (queries ** 2).sum(axis=1)[:, None] - 2 * queries @ corpus.T + (corpus ** 2).sum(axis=1)[None, :]
+    return np.argsort(distances, axis=1)[:, :k]
+
+
+def rss_bytes():
+    """Resident set size of this process (Linux only, None elsewhere)."""
+    try:
+        with open("/proc/self/statm") as statm:
+            return int(statm.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError):
+        return None
+
+
+def estimated_index_bytes(num_vectors, dim, m):
+    """Rough hnswlib size: vectors plus level-0 links (2*M neighbours) plus id labels."""
+    return num_vectors * (dim * 4 + (2 * m + 1) * 4 + 8)
+
+
+def warm_up_client(client, ids, corpus):
+    """Builds, queries and drops a throwaway index over the whole corpus.
+
+    One-time ChromaDB initialization and the first growth of the allocator arenas would otherwise
+    be counted in the RSS delta of the first setting only.
+    """
+    collection = client.create_collection(f"sweep-warmup-{uuid.uuid4().hex}", embedding_function=None)
+    for start in range(0, len(ids), ADD_BATCH_SIZE):
+        collection.add(ids=ids[start:start + ADD_BATCH_SIZE], embeddings=corpus[start:start + ADD_BATCH_SIZE].tolist())
+    collection.query(query_embeddings=[corpus[0].tolist()], n_results=1, include=[])
+    client.delete_collection(collection.name)
+    gc.collect()
+
+
+def run_setting(client, ids, corpus, queries, exact, relevant, setting, k):
+    space, m, construction_ef, search_ef = setting
+    metadata = build_index_metadata(space, m, construction_ef, search_ef)
+
+    gc.collect()
+    rss_before = rss_bytes()
+    build_start = time.perf_counter()
+    collection = client.create_collection(f"sweep-{uuid.uuid4().hex}", metadata=metadata, embedding_function=None)
+    for start in range(0, len(ids), ADD_BATCH_SIZE):
+        collection.add(ids=ids[start:start + ADD_BATCH_SIZE], embeddings=corpus[start:start + ADD_BATCH_SIZE].tolist())
+    build_seconds = time.perf_counter() - build_start
+
+    # Warm-up query so the index is loaded before timing
+    collection.query(query_embeddings=[queries[0].tolist()], n_results=k, include=[])
+    rss_after = rss_bytes()
+
+    id_positions = {doc_id: position for position, doc_id in enumerate(ids)}
+    latencies, recalls, hits = [], [], []
+    for query_index, query in enumerate(queries):
+        query_start = time.perf_counter()
+        result = collection.query(query_embeddings=[query.tolist()], n_results=k, include=[])
+        latencies.append((time.perf_counter() - query_start) * 1000)
+        found = [id_positions[doc_id] for doc_id in result["ids"][0]]
+        recalls.append(len(set(found) & set(exact[query_index].tolist())) / k)
+        if relevant is not None:
+            hits.append(float(relevant[query_index] in result["ids"][0]))
+
+    client.delete_collection(collection.name)
+    latencies.sort()
+    return {
+        "space": space,
+        "M": m,
+        "construction_ef": construction_ef,
+        "search_ef": search_ef,
+        f"recall@{k}": statistics.mean(recalls),
+        f"hit@{k}": statistics.mean(hits) if hits else None,
+        "p50_ms": latencies[len(latencies) // 2],
+        "p95_ms": latencies[min(len(latencies) - 1, int(len(latencies) * 0.95))],
+        "build_s": build_seconds,
+        "rss_delta_mb": (rss_after - rss_before) / 2**20 if rss_before is not None else None,
+        "est_index_mb": estimated_index_bytes(len(ids), corpus.shape[1], m) / 2**20,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--csv-path", default="data/wow_data.csv", help="Corpus CSV (class, spec, description)")
+    parser.add_argument("--queries", help="CSV with a `query` column and an optional `relevant_id` column")
+    parser.add_argument("--synthetic", type=int, help="Use N random vectors instead of embedding the corpus")
+    parser.add_argument("--dim", type=int, default=384, help="Dimension of the synthetic vectors")
+    parser.add_argument("--num-queries", type=int, default=200, help="Number of synthetic queries")
+    parser.add_argument("--k", type=int, default=5)
+    parser.add_argument("--space", nargs="+", default=["l2"], choices=INDEX_SPACES)
+    parser.add_argument("--m", nargs="+", type=int, default=[8, 16, 32])
+    parser.add_argument("--construction-ef", nargs="+", type=int, default=[100])
+    parser.add_argument("--search-ef", nargs="+", type=int, default=[10, 50, 100])
+    parser.add_argument("--output", help="Also write the report to this CSV file")
+    args = parser.parse_args()
+
+    ids, corpus, queries, relevant = load_corpus(args)
+    k = min(args.k, len(ids))
+    client = chromadb.EphemeralClient()
+    warm_up_client(client, ids, corpus)
+
+    rows = []
+    for space in args.space:
+        exact = exact_top_k(corpus, queries, space, k)
+        for m, construction_ef, search_ef in itertools.product(args.m, args.construction_ef, args.search_ef):
+            row = run_setting(client, ids, corpus, queries, exact, relevant, (space, m, construction_ef, search_ef), k)
+            rows.append(row)
+            print(", ".join(f"{key}={value:.3f}" if isinstance(value, float) else f"{key}={value}" for key, value in row.items()))
+
+    report = pd.DataFrame(rows)
+    print()
+    print(report.to_string(index=False, float_format=lambda value: f"{value:.3f}"))
+    if args.output:
+        report.to_csv(args.output, index=False)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,104 @@
+# benchmarks/response_payload.py
+"""Compares /query response size and serialization time before and after the lean payload changes.
+
+"before" reproduces the previous response: the sources without ids, validated through the previous
+QueryResponse/Source(document, metadata) models and rendered by Starlette's JSONResponse (what
+FastAPI did with response_model=QueryResponse). "after" applies a sources projection and serializes
+with orjson, as ORJSONResponse does.
+
+Usage:
+    PYTHONPATH=src python benchmarks/response_payload.py --num-results 50 --doc-length 4000
+"""
+import argparse
+import gzip
+import time
+from typing import Dict, List
+
+import orjson
+import pandas as pd
+from pydantic import BaseModel
+from starlette.responses import JSONResponse
+
+from kf_rag_wowinfo.utils import SOURCE_PROJECTIONS, project_sources
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+
+class BaselineSource(BaseModel):
+    """Source model before the sources projection."""
+    document: str
+    metadata: Dict[str, str]
+
+
+class BaselineQueryResponse(BaseModel):
+    answer: str
+    sources: List[BaselineSource]
+
+
+def build_result(csv_path: str, num_results: int, doc_length: int):
+    """Builds an answer_question-like result whose sources are CSV descriptions padded to doc_length."""
+    df = pd.read_csv(csv_path)
+    rows = df.to_dict("records")
+    sources = []
+    for i in range(num_results):
+        row = rows[i % len(rows)]
+        text = row["description"]
+        document = (text + " ") * (doc_length // (len(text) + 1) + 1)
+        sources.append({
+            "id": f"{row['class']}-{row['spec']}-{i}",
+            "document": document[:doc_length],
+            "metadata": {"class": row["class"], "spec": row["spec"]},
+        })
+    return {"answer": "Warriors use heavy armor and weapons to deal melee damage. " * 5, "sources": sources}
+
+
+def time_it(func, repeat: int):
+    start = time.perf_counter()
+    for _ in range(repeat):
+        body = func()
+    return body, (time.perf_counter() - start) / repeat * 1e6
+
+
+def report(name: str, body: bytes, micros: float):
+    gzip_size = len(gzip.compress(body))
+    br_size = len(brotli.compress(body)) if brotli else None
+    br_text = f"{br_size:>10}" if br_size is not None else f"{'n/a':>10}"
+    print(f"{name:<18}{len(body):>10}{gzip_size:>10}{br_text}{micros:>14.1f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--csv-path", default="data/wow_data.csv")
+    parser.add_argument("--num-results", type=int, default=50)
+    parser.add_argument("--doc-length", type=int, default=4000)
+    parser.add_argument("--snippet-length", type=int, default=200)
+    parser.add_argument("--repeat", type=int, default=200)
+    args = parser.parse_args()
+
+    result = build_result(args.csv_path, args.num_results, args.doc_length)
+
+    print(f"{args.num_results} sources of {args.doc_length} characters, mean of {args.repeat} runs")
+    print(f"{'variant':<18}{'raw B':>10}{'gzip B':>10}{'br B':>10}{'serialize us':>14}")
+
+    baseline_result = dict(result, sources=[{"document": source["document"], "metadata": source["metadata"]}
+                                            for source in result["sources"]])
+    render = JSONResponse(content=None).render
+
+    def before():
+        return render(BaselineQueryResponse.model_validate(baseline_result).model_dump(mode="json"))
+
+    report("before (full)", *time_it(before, args.repeat))
+
+    for projection in SOURCE_PROJECTIONS:
+        def after():
+            projected = dict(result, sources=project_sources(result["sources"], projection, args.snippet_length))
+            return orjson.dumps(projected)
+
+        report(f"after ({projection})", *time_it(after, args.repeat))
+
+
+if __name__ == "__main__":
+    main()
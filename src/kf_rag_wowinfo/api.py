@@ -1,16 +1,52 @@
 # rag_wowinfo/api.py
 from fastapi import FastAPI, Query, HTTPException, Form, Depends
-from typing import Optional, List, Dict
+from fastapi.concurrency import run_in_threadpool
+from fastapi.middleware.gzip import GZipMiddleware
+from fastapi.responses import ORJSONResponse
+from typing import Optional, List, Dict, Literal
 from .schemas import QueryResponse, Feedback, DocumentUpload, DocumentSummaryRequest, DocumentComparisonRequest, TranslationRequest, MultiTurnRequest, GeneratedQuestionsRequest, ParaphraseRequest, NERResponse
-from .main import answer_question, summarize_content, compare_documents, translate_with_context, multi_turn_qa, generate_questions_from_text, paraphrase_text, extract_entities_from_text
-from .database import get_collection, add_document_to_chroma, update_document_in_chroma, delete_document_from_chroma, load_data_to_chroma, get_document_by_id
-from .utils import clean_text, is_valid_url, get_url_content
+from .main import answer_cache, answer_question, summarize_content, compare_documents, translate_with_context, multi_turn_qa, generate_questions_from_text, paraphrase_text, extract_entities, generate_enrichment
+from .database import embed_query, add_document_to_chroma, load_data_to_chroma, store_enrichment, delete_enrichment, get_stored_summary, get_stored_questions
+from .sharding import SHARD_KEY, find_document, collection_for_metadata, update_document, delete_document, load_data_to_shards
+from .snapshot import export_snapshot, import_snapshot
+from .event_log import EventLog, top_queries
+from .gazetteer import invalidate_gazetteer
+from .utils import clean_text, is_valid_url, get_url_content, project_sources
+import chromadb.errors
 import os
+import threading
+import time
 import uuid
 from fastapi.openapi.utils import get_openapi
 
-
-app = FastAPI()
+try:
+    from brotli_asgi import BrotliMiddleware  # Optional: br compression, falls back to gzip
+except ImportError:
+    BrotliMiddleware = None
+
+# Responses smaller than this (in bytes) are sent uncompressed
+COMPRESSION_MIN_SIZE = int(os.environ.get("COMPRESSION_MIN_SIZE", 1000))
+# Length of the document excerpt returned with sources=snippets
+SNIPPET_LENGTH = int(os.environ.get("SNIPPET_LENGTH", 200))
+# Directory the admin snapshot endpoints read from and write to
+SNAPSHOT_DIR = os.path.realpath(os.environ.get("SNAPSHOT_DIR", "snapshots"))
+# Query/feedback event log (empty EVENT_LOG_DIR disables it)
+EVENT_LOG_DIR = os.environ.get("EVENT_LOG_DIR", "logs/events")
+EVENT_LOG_FORMAT = os.environ.get("EVENT_LOG_FORMAT", "jsonl")
+EVENT_LOG_MAX_FILE_MB = int(os.environ.get("EVENT_LOG_MAX_FILE_MB", 10))
+EVENT_LOG_MAX_FILE_SECONDS = float(os.environ.get("EVENT_LOG_MAX_FILE_SECONDS", 300))
+# Number of most frequent logged queries replayed at startup to warm the caches (0 disables it)
+WARMUP_TOP_N = int(os.environ.get("WARMUP_TOP_N", 0))
+# Query parameters recorded in the event log and replayed by the warm-up
+REPLAYED_QUERY_FIELDS = ("query", "num_results", "creativity", "max_length", "response_format", "additional_context")
+
+
+app = FastAPI(default_response_class=ORJSONResponse)
+
+if BrotliMiddleware is not None:
+    app.add_middleware(BrotliMiddleware, minimum_size=COMPRESSION_MIN_SIZE, gzip_fallback=True)
+else:
+    app.add_middleware(GZipMiddleware, minimum_size=COMPRESSION_MIN_SIZE)
 
 def custom_openapi():
     """Customizes the OpenAPI schema."""
@@ -39,6 +75,38 @@ async def get_openapi_json():
 # Database simulation for conversation history (multi-turn)
 conversation_history = {}
 
+event_log = EventLog(EVENT_LOG_DIR, EVENT_LOG_FORMAT, max_file_bytes=EVENT_LOG_MAX_FILE_MB * 2**20,
+                     max_file_seconds=EVENT_LOG_MAX_FILE_SECONDS) if EVENT_LOG_DIR else None
+
+
+def warm_up_caches(top_n: int):
+    """Replays the most frequent logged queries to fill the embedding and answer caches."""
+    for params in top_queries(EVENT_LOG_DIR, top_n, REPLAYED_QUERY_FIELDS):
+        try:
+            embed_query(params["query"])
+            # Same defaults as /query, but keep logged falsy values such as creativity=0.0 (part of the cache key)
+            num_results = 5 if params["num_results"] is None else params["num_results"]
+            creativity = 0.5 if params["creativity"] is None else params["creativity"]
+            answer_question("wowinfo", params["query"], num_results, creativity,
+                            params["max_length"], params["response_format"], params["additional_context"])
+        except Exception as e:  # The warm-up is best effort, a failing query must not stop the others
+            print(f"Cache warm-up failed for query {params['query']!r}: {e}")
+
+
+@app.on_event("startup")
+async def startup_event():
+    if event_log:
+        event_log.start()
+        if WARMUP_TOP_N > 0:
+            # In the background so the API starts serving right away
+            threading.Thread(target=warm_up_caches, args=(WARMUP_TOP_N,), name="cache-warm-up", daemon=True).start()
+
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    if event_log:
+        event_log.close()
+
 
 # --- Endpoints ---
 @app.get("/query", response_model=QueryResponse)
@@ -48,7 +116,8 @@ async def query_endpoint(
     creativity: float = Query(0.5, title="Creativity", ge=0.0, le=1.0),
     max_length: Optional[int] = Query(None, title="Max Length"),
     response_format: Optional[str] = Query(None, title="Response Format"),
-    additional_context: Optional[str] = Query(None, title="Additional Context")
+    additional_context: Optional[str] = Query(None, title="Additional Context"),
+    sources: Literal["ids", "metadata", "snippets", "full"] = Query("full", title="Sources", description="Fields returned for each source")
 ):
     """Answers questions using the RAG model.
 
@@ -59,12 +128,24 @@ async def query_endpoint(
         max_length (Optional[int]): The maximum length of the response.
         response_format (Optional[str]): The format of the response.
         additional_context (Optional[str]): Additional context to provide to the model.
+        sources (str): The fields returned for each source: ids, metadata, snippets or full.
 
     Returns:
-        QueryResponse: The answer and sources from the RAG model.
+        QueryResponse: The answer, the sources from the RAG model and the query ID to send feedback.
     """
+    query_id = str(uuid.uuid4())
+    start = time.perf_counter()
     result = answer_question("wowinfo", query, num_results, creativity, max_length, response_format, additional_context)
-    return result
+    latency_ms = (time.perf_counter() - start) * 1000
+    if event_log:
+        event_log.log("query", query_id=query_id, query=query, num_results=num_results, creativity=creativity,
+                      max_length=max_length, response_format=response_format, additional_context=additional_context,
+                      answer=result["answer"], source_ids=[source.get("id") for source in result["sources"]],
+                      latency_ms=round(latency_ms, 3))
+    # Copy, the result may be shared with the answer cache
+    result = {"answer": result["answer"], "sources": project_sources(result["sources"], sources, SNIPPET_LENGTH), "query_id": query_id}
+    # The result is built by answer_question, so it skips the response_model re-validation
+    return ORJSONResponse(content=result)
 
 
 @app.post("/feedback", status_code=201)
@@ -77,10 +158,8 @@ async def feedback_endpoint(feedback: Feedback):
     Returns:
         dict: A message indicating that the feedback was received successfully.
     """
-    # proyecto_rag/api.py (continuación)
-    """Receives feedback on the answers."""
-    # In a real application, you would save this in a database
-    print(f"Received feedback for query {feedback.query_id}: {feedback.feedback}, comment: {feedback.comment}")
+    if event_log:
+        event_log.log("feedback", query_id=feedback.query_id, feedback=feedback.feedback, comment=feedback.comment)
     return {"message": "Feedback received successfully"}
 
 
@@ -112,7 +191,12 @@ async def summarize_endpoint(request: DocumentSummaryRequest):
     document_text = ""
 
     if request.document_id:
-        doc_info = get_document_by_id(get_collection(), request.document_id)
+        # Summaries precomputed at ingest time are served without calling the model
+        stored_summary = get_stored_summary("wowinfo", request.document_id, request.summary_length, request.summary_style)
+        if stored_summary:
+            return stored_summary
+
+        doc_info = find_document("wowinfo", request.document_id)
         if doc_info:
             document_text = doc_info["document"]
         else:
@@ -154,7 +238,7 @@ async def compare_endpoint(request: DocumentComparisonRequest):
     doc2_text = ""
 
     if request.document1_id:
-      doc1_info = get_document_by_id(get_collection(), request.document1_id)
+      doc1_info = find_document("wowinfo", request.document1_id)
       if doc1_info:
           doc1_text = doc1_info["document"]
       else:
@@ -164,7 +248,7 @@ async def compare_endpoint(request: DocumentComparisonRequest):
 
 
     if request.document2_id:
-      doc2_info = get_document_by_id(get_collection(), request.document2_id)
+      doc2_info = find_document("wowinfo", request.document2_id)
       if doc2_info:
           doc2_text = doc2_info["document"]
       else:
@@ -192,7 +276,7 @@ async def translate_endpoint(request: TranslationRequest):
   translation = await translate_with_context(request.text, request.target_language)
   return translation
 
-@app.post("/multi_turn", response_model=QueryResponse)
+@app.post("/multi_turn", response_model=QueryResponse, response_model_exclude_none=True)
 async def multi_turn_endpoint(request: MultiTurnRequest):
     """Handles multi-turn conversations.
 
@@ -232,7 +316,12 @@ async def generate_questions_endpoint(request: GeneratedQuestionsRequest):
   """
   document_text = ""
   if request.document_id:
-    doc_info = get_document_by_id(get_collection(), request.document_id)
+    # Questions precomputed at ingest time are served without calling the model
+    stored_questions = get_stored_questions("wowinfo", request.document_id)
+    if len(stored_questions) >= request.num_questions:
+        return "\n".join(stored_questions[:request.num_questions])
+
+    doc_info = find_document("wowinfo", request.document_id)
     if doc_info:
         document_text = doc_info["document"]
     else:
@@ -261,16 +350,20 @@ async def paraphrase_endpoint(request: ParaphraseRequest):
 
 
 @app.post("/extract_entities", response_model=NERResponse)
-async def ner_endpoint(text: str = Form(...)):
+async def ner_endpoint(text: str = Form(...), use_llm: bool = Form(False)):
     """Extracts named entities from a given text.
 
+    Known entities (classes, specs, ...) are matched locally; the LLM is only used for unknown
+    capitalized names or when requested.
+
     Args:
         text (str): The text to extract entities from.
+        use_llm (bool): Whether to always ask the LLM too.
 
     Returns:
         NERResponse: A list of dictionaries, where each dictionary contains an entity and its type.
     """
-    entities = await extract_entities_from_text(text)
+    entities = await extract_entities(text, use_llm)
     return {"entities": entities}
 
 
@@ -304,11 +397,26 @@ def get_current_username(credentials: HTTPBasicCredentials = Depends(security)):
       )
 
 
+def enrich_document(doc_id: str, document: str) -> Optional[str]:
+    """Generates and stores the enrichment of a document. Returns the error message if it failed.
+
+    Blocking (two LLM calls): run it with run_in_threadpool from the endpoints.
+    """
+    try:
+        enrichment = generate_enrichment(document)
+        store_enrichment("wowinfo", doc_id, enrichment["summary"], enrichment["questions"])
+    except Exception as e:  # The document itself is already stored, only its enrichment is missing
+        print(f"Enrichment failed for document {doc_id}: {e}")
+        return str(e)
+    return None
+
+
 @app.post("/admin/add_document", status_code=201)
 async def add_document_endpoint(
     document: str = Form(...),
     metadata: str = Form(...),
     doc_id: str = Form(...),
+    enrich: bool = Form(False),
     username: str = Depends(get_current_username) #Autenticación
 ):
     """Adds a document to the knowledge base.
@@ -317,10 +425,11 @@ async def add_document_endpoint(
         document (str): The document to add.
         metadata (str): The metadata associated with the document.
         doc_id (str): The ID of the document.
+        enrich (bool): Whether to precompute the summary and synthetic questions of the document.
         username (str): The username of the authenticated user.
 
     Returns:
-        dict: A message indicating that the document was added successfully.
+        dict: A message indicating that the document was added successfully, and the enrichment error if any.
     """
     try:
       metadata_dict = eval(metadata)  # Use eval() safely with a dictionary string.
@@ -329,7 +438,12 @@ async def add_document_endpoint(
     except (SyntaxError, ValueError) as e:
       raise HTTPException(status_code=400, detail=f"Invalid metadata format: {e}")
 
-    add_document_to_chroma(get_collection(), document, metadata_dict, doc_id)
+    add_document_to_chroma(collection_for_metadata("wowinfo", metadata_dict), document, metadata_dict, doc_id)
+    enrichment_error = await run_in_threadpool(enrich_document, doc_id, document) if enrich else None
+    answer_cache.clear()  # Cached answers and the gazetteer may rely on the previous documents
+    invalidate_gazetteer()
+    if enrichment_error:
+        return {"message": "Document added successfully", "enrichment_error": enrichment_error}
     return {"message": "Document added successfully"}
 
 @app.post("/admin/update_document")
@@ -337,6 +451,7 @@ async def update_document_endpoint(
     doc_id: str = Form(...),
     document: Optional[str] = Form(None),
     metadata: Optional[str] = Form(None),
+    enrich: bool = Form(False),
     username: str = Depends(get_current_username)
 ):
     """Updates an existing document in the knowledge base.
@@ -345,10 +460,11 @@ async def update_document_endpoint(
         doc_id (str): The ID of the document to update.
         document (Optional[str]): The updated document content.
         metadata (Optional[str]): The updated metadata associated with the document.
+        enrich (bool): Whether to recompute the summary and synthetic questions of the document.
         username (str): The username of the authenticated user.
 
     Returns:
-        dict: A message indicating that the document was updated successfully.
+        dict: A message indicating that the document was updated successfully, and the enrichment error if any.
     """
     metadata_dict = None
     if metadata:
@@ -359,7 +475,19 @@ async def update_document_endpoint(
         except (SyntaxError, ValueError) as e:
             raise HTTPException(status_code=400, detail=f"Invalid metadata format: {e}")
 
-    update_document_in_chroma(get_collection(), doc_id, document, metadata_dict)
+    if not update_document("wowinfo", doc_id, document, metadata_dict):
+        raise HTTPException(status_code=404, detail="Document not found")
+    enrichment_error = None
+    if enrich:
+        doc_info = find_document("wowinfo", doc_id)
+        if doc_info:
+            enrichment_error = await run_in_threadpool(enrich_document, doc_id, doc_info["document"])
+    if document and (not enrich or enrichment_error):
+        delete_enrichment("wowinfo", doc_id)  # The stored summary and questions no longer match the text
+    answer_cache.clear()
+    invalidate_gazetteer()
+    if enrichment_error:
+        return {"message": "Document updated successfully", "enrichment_error": enrichment_error}
     return {"message": "Document updated successfully"}
 
 @app.delete("/admin/delete_document")
@@ -373,19 +501,130 @@ async def delete_document_endpoint(doc_id: str = Query(...), username: str = Dep
     Returns:
         dict: A message indicating that the document was deleted successfully.
     """
-    delete_document_from_chroma(get_collection(), doc_id)
+    delete_document("wowinfo", doc_id)
+    answer_cache.clear()
+    invalidate_gazetteer()
     return {"message": "Document deleted successfully"}
 
 
 @app.post("/admin/reload_data", status_code=201) #To reload data from the CSV
-async def reload_data_endpoint(username: str = Depends(get_current_username)):
+async def reload_data_endpoint(
+    enrich: bool = Query(False, title="Enrich", description="Precompute summaries and synthetic questions"),
+    username: str = Depends(get_current_username)
+):
     """Reloads data from the CSV file into the ChromaDB collection.
 
     Args:
+        enrich (bool): Whether to precompute the summaries and synthetic questions of the documents.
         username (str): The username of the authenticated user.
 
     Returns:
-        dict: A message indicating that the data was reloaded successfully.
+        dict: A message indicating that the data was reloaded successfully, and the documents whose enrichment failed.
     """
-    load_data_to_chroma()
+    enricher = generate_enrichment if enrich else None
+    # Loading (and enriching) is blocking, keep it off the event loop
+    if SHARD_KEY:
+        _, failed = await run_in_threadpool(load_data_to_shards, enricher=enricher)
+    else:
+        failed = await run_in_threadpool(load_data_to_chroma, enricher=enricher)
+    answer_cache.clear()
+    invalidate_gazetteer()
+    if failed:
+        return {"message": "Data reloaded successfully from CSV", "enrichment_failed": failed}
     return {"message": "Data reloaded successfully from CSV"}
+
+
+@app.post("/admin/reload_shard", status_code=201)
+async def reload_shard_endpoint(
+    shard_value: str = Query(..., title="Shard Value", description="The SHARD_KEY value of the shard to rebuild"),
+    enrich: bool = Query(False, title="Enrich", description="Precompute summaries and synthetic questions"),
+    username: str = Depends(get_current_username)
+):
+    """Rebuilds a single shard from the CSV file, leaving the other shards untouched.
+
+    Args:
+        shard_value (str): The SHARD_KEY value of the shard to rebuild (e.g. "Mage" when sharding by class).
+        enrich (bool): Whether to precompute the summaries and synthetic questions of the documents.
+        username (str): The username of the authenticated user.
+
+    Returns:
+        dict: A message indicating which shard was reloaded.
+    """
+    if not SHARD_KEY:
+        raise HTTPException(status_code=400, detail="Sharding is disabled, set SHARD_KEY to enable it")
+    loaded, failed = await run_in_threadpool(load_data_to_shards, enricher=generate_enrichment if enrich else None,
+                                             shard_value=shard_value)
+    if not loaded:
+        raise HTTPException(status_code=404, detail=f"No documents with {SHARD_KEY}={shard_value} in the CSV")
+    answer_cache.clear()
+    invalidate_gazetteer()
+    if failed:
+        return {"message": f"Shard {loaded[0]} reloaded successfully from CSV", "enrichment_failed": failed}
+    return {"message": f"Shard {loaded[0]} reloaded successfully from CSV"}
+
+
+def resolve_snapshot_path(path: str) -> str:
+    """Resolves a snapshot path relative to SNAPSHOT_DIR, refusing paths outside of it.
+
+    Raises:
+        HTTPException: If the path escapes SNAPSHOT_DIR.
+    """
+    resolved = os.path.realpath(os.path.join(SNAPSHOT_DIR, path))
+    if os.path.commonpath([resolved, SNAPSHOT_DIR]) != SNAPSHOT_DIR or resolved == SNAPSHOT_DIR:
+        raise HTTPException(status_code=400, detail=f"Snapshot paths must be files inside {SNAPSHOT_DIR}")
+    return resolved
+
+
+@app.post("/admin/export_collection")
+async def export_collection_endpoint(
+    path: str = Form(...),
+    collection_name: str = Form("wowinfo"),
+    username: str = Depends(get_current_username)
+):
+    """Exports a collection, including its embeddings, to a Parquet file in SNAPSHOT_DIR on the server.
+
+    Args:
+        path (str): The path of the Parquet file to write, relative to SNAPSHOT_DIR.
+        collection_name (str): The name of the collection to export.
+        username (str): The username of the authenticated user.
+
+    Returns:
+        dict: A message with the number of exported documents.
+    """
+    snapshot_path = resolve_snapshot_path(path)
+    try:
+        os.makedirs(os.path.dirname(snapshot_path), exist_ok=True)
+        exported = await run_in_threadpool(export_snapshot, snapshot_path, collection_name)
+    except LookupError as e:
+        raise HTTPException(status_code=404, detail=str(e))
+    except OSError as e:
+        raise HTTPException(status_code=400, detail=f"Could not write the snapshot: {e}")
+    return {"message": f"Exported {exported} documents to {path}"}
+
+
+@app.post("/admin/import_collection", status_code=201)
+async def import_collection_endpoint(
+    path: str = Form(...),
+    collection_name: Optional[str] = Form(None),
+    username: str = Depends(get_current_username)
+):
+    """Imports a Parquet snapshot from SNAPSHOT_DIR into a collection using its precomputed embeddings.
+
+    Args:
+        path (str): The path of the Parquet file, relative to SNAPSHOT_DIR.
+        collection_name (Optional[str]): The target collection. Defaults to the collection the snapshot was exported from.
+        username (str): The username of the authenticated user.
+
+    Returns:
+        dict: A message with the number of imported documents.
+    """
+    snapshot_path = resolve_snapshot_path(path)
+    if not os.path.isfile(snapshot_path):
+        raise HTTPException(status_code=404, detail=f"Snapshot not found: {path}")
+    try:
+        result = await run_in_threadpool(import_snapshot, snapshot_path, collection_name)
+    except (ValueError, OSError, chromadb.errors.ChromaError) as e:  # e.g. a collection name ChromaDB rejects
+        raise HTTPException(status_code=400, detail=str(e))
+    answer_cache.clear()
+    invalidate_gazetteer()
+    return {"message": f"Imported {result['imported']} documents into {result['collection_name']}"}
@@ -1,26 +1,119 @@
 # rag_wowinfo/database.py
 import chromadb
+import chromadb.errors
 from chromadb.utils import embedding_functions
 import pandas as pd
+import numpy as np
+import pyarrow as pa
+import pyarrow.parquet as pq
+import json
 import os
+import threading
+import time
+from typing import Callable, Dict, List, Optional
 from dotenv import load_dotenv
+from .utils import build_index_metadata, LRUCache
 
 load_dotenv()  #Loads .env *before* using os.environ
 chroma_host = os.environ.get("CHROMA_HOST", "localhost")
 print(f"CHROMA_HOST: {chroma_host}")
 
 client = chromadb.HttpClient(host=chroma_host, port=8000)
-embedding_function = embedding_functions.SentenceTransformerEmbeddingFunction(model_name="all-MiniLM-L6-v2")
+EMBEDDING_MODEL = "all-MiniLM-L6-v2"
+embedding_function = embedding_functions.SentenceTransformerEmbeddingFunction(model_name=EMBEDDING_MODEL)
 
-def get_collection(collection_name="wowinfo"):
-    return client.get_or_create_collection(collection_name, embedding_function=embedding_function)
+# Query embeddings are cached so repeated queries, the questions index and every shard reuse them
+embedding_cache = LRUCache(int(os.environ.get("EMBEDDING_CACHE_SIZE", 4096)))
 
-def load_data_to_chroma(csv_path="data/wow_data.csv", collection_name="wowinfo"):
-    collection = get_collection(collection_name)
+def embed_query(text):
+    """Embeds a query text, reusing the cached embedding if the text was embedded before."""
+    embedding = embedding_cache.get(text)
+    if embedding is None:
+        embedding = embedding_function([text])[0]
+        embedding_cache.set(text, embedding)
+    return embedding
+
+def _optional_int(name):
+    value = os.environ.get(name)
+    return int(value) if value else None
+
+# Vector index settings, applied when a collection is created (unset values keep ChromaDB defaults).
+# HNSW parameters cannot be changed on an existing collection: recreate it to apply new values.
+index_metadata = build_index_metadata(
+    space=os.environ.get("CHROMA_DISTANCE") or None,
+    m=_optional_int("CHROMA_HNSW_M"),
+    construction_ef=_optional_int("CHROMA_HNSW_CONSTRUCTION_EF"),
+    search_ef=_optional_int("CHROMA_HNSW_SEARCH_EF"),
+)
+
+# Enrichers receive a document text and return {"summary": str, "questions": List[str]}
+Enricher = Callable[[str], Dict]
+
+def get_collection(collection_name="wowinfo", index_settings: Optional[Dict] = None):
+    """Gets or creates a collection. `index_settings` (see utils.build_index_metadata) overrides the configured index settings."""
+    metadata = index_settings if index_settings is not None else index_metadata
+    return client.get_or_create_collection(collection_name, embedding_function=embedding_function, metadata=metadata or None)
+
+# Raised for a missing collection, depending on the ChromaDB version (older versions raise a plain ValueError)
+COLLECTION_NOT_FOUND_ERRORS = tuple(error for error in (
+    getattr(chromadb.errors, "NotFoundError", None),
+    getattr(chromadb.errors, "InvalidCollectionException", None),
+) if error is not None) or (ValueError,)
+
+def find_collection(collection_name):
+    """Gets an existing collection without creating it. Returns None if it does not exist."""
+    try:
+        return client.get_collection(collection_name, embedding_function=embedding_function)
+    except COLLECTION_NOT_FOUND_ERRORS:
+        return None
+
+def get_summaries_collection(collection_name="wowinfo"):
+    """Auxiliary collection holding one precomputed summary per document (id = document id)."""
+    return get_collection(f"{collection_name}_summaries")
+
+def get_questions_collection(collection_name="wowinfo"):
+    """Auxiliary index of synthetic questions, each pointing back to its document via metadata['doc_id']."""
+    return get_collection(f"{collection_name}_questions")
+
+# Seconds before an auxiliary collection is looked up again, so enrichment stored by other workers is picked up
+ENRICHMENT_CHECK_TTL = float(os.environ.get("ENRICHMENT_CHECK_TTL", 60))
+_enrichment_lock = threading.Lock()
+# Auxiliary collection name -> (Collection or None if missing, document count, time.monotonic() of the lookup).
+# Saves the lookup and count round-trips on every read, and deployments without enrichment skip it entirely.
+_enrichment_collections: Dict[str, tuple] = {}
+
+def _find_enrichment_collection(name):
+    """Returns an existing auxiliary collection and its document count, (None, 0) if it does not exist. Never creates it."""
+    with _enrichment_lock:
+        cached = _enrichment_collections.get(name)
+    if cached is not None and time.monotonic() - cached[2] < ENRICHMENT_CHECK_TTL:
+        return cached[0], cached[1]
+    collection = find_collection(name)
+    try:
+        count = collection.count() if collection is not None else 0
+    except COLLECTION_NOT_FOUND_ERRORS:
+        collection, count = None, 0
+    with _enrichment_lock:
+        _enrichment_collections[name] = (collection, count, time.monotonic())
+    return collection, count
+
+def _forget_enrichment_collection(name):
+    """Drops the cached lookup of an auxiliary collection after it changed, so the next read checks it again."""
+    with _enrichment_lock:
+        _enrichment_collections.pop(name, None)
+
+def read_csv_documents(csv_path="data/wow_data.csv"):
+    """Reads the knowledge base CSV. Returns the ids, documents and metadatas of its rows."""
     df = pd.read_csv(csv_path)
     documents = df['description'].tolist()
     metadatas = df[['class', 'spec']].to_dict('records')
     ids = [f"{row['class']}-{row['spec']}" for index, row in df.iterrows()]
+    return ids, documents, metadatas
+
+def load_data_to_chroma(csv_path="data/wow_data.csv", collection_name="wowinfo", enricher: Optional[Enricher] = None):
+    """Loads the CSV into the collection. Returns the ids of the documents whose enrichment failed."""
+    collection = get_collection(collection_name)
+    ids, documents, metadatas = read_csv_documents(csv_path)
 
     collection.add(
         documents=documents,
@@ -28,8 +121,12 @@ def load_data_to_chroma(csv_path="data/wow_data.csv", collection_name="wowinfo")
         ids=ids
     )
 
+    if enricher:
+        return enrich_documents(collection_name, ids, documents, enricher)
+    return []
+
 def query_chroma(collection, query_texts, n_results=5):
-    return collection.query(query_texts=query_texts, n_results=n_results)
+    return collection.query(query_embeddings=[embed_query(text) for text in query_texts], n_results=n_results)
 
 def add_document_to_chroma(collection, document, metadata, doc_id):
     collection.add(documents=[document], metadatas=[metadata], ids=[doc_id])
@@ -44,6 +141,7 @@ def update_document_in_chroma(collection, doc_id, document=None, metadata=None):
 
 def delete_document_from_chroma(collection, doc_id):
     collection.delete(ids=[doc_id])
+    delete_enrichment(collection.name, doc_id)
 
 def get_document_by_id(collection, doc_id):
     result = collection.get(ids=[doc_id], include=["documents", "metadatas"])
@@ -55,5 +153,160 @@ def get_document_by_id(collection, doc_id):
     else:
       return None
 
+# --- Enrichment (precomputed summaries and synthetic questions) ---
+
+def store_enrichment(collection_name, doc_id, summary, questions, summary_length="medium", summary_style="general"):
+    """Stores the summary and questions of a document, replacing any previous enrichment."""
+    get_summaries_collection(collection_name).upsert(
+        ids=[doc_id],
+        documents=[summary],
+        metadatas=[{"doc_id": doc_id, "summary_length": summary_length, "summary_style": summary_style}]
+    )
+    questions_collection = get_questions_collection(collection_name)
+    questions_collection.delete(where={"doc_id": doc_id})
+    if questions:
+        questions_collection.add(
+            documents=questions,
+            metadatas=[{"doc_id": doc_id} for _ in questions],
+            ids=[f"{doc_id}-q{i}" for i in range(len(questions))]
+        )
+    _forget_enrichment_collection(f"{collection_name}_summaries")
+    _forget_enrichment_collection(f"{collection_name}_questions")
+
+def enrich_documents(collection_name, ids, documents, enricher: Enricher) -> List[str]:
+    """Enriches every document, carrying on past failures. Returns the ids of the documents that failed."""
+    failed = []
+    for doc_id, document in zip(ids, documents):
+        try:
+            enrichment = enricher(document)
+            store_enrichment(collection_name, doc_id, enrichment["summary"], enrichment["questions"])
+        except Exception as e:  # One failing LLM call must not abort the whole load
+            print(f"Enrichment failed for document {doc_id}: {e}")
+            failed.append(doc_id)
+    return failed
+
+def delete_enrichment(collection_name, doc_id):
+    """Deletes the summary and questions of a document, if any. Auxiliary collections that don't exist are not created."""
+    # Looked up uncached: another worker may have enriched the document since the last lookup
+    summaries_collection = find_collection(f"{collection_name}_summaries")
+    if summaries_collection is not None:
+        summaries_collection.delete(ids=[doc_id])
+        _forget_enrichment_collection(summaries_collection.name)
+    questions_collection = find_collection(f"{collection_name}_questions")
+    if questions_collection is not None:
+        questions_collection.delete(where={"doc_id": doc_id})
+        _forget_enrichment_collection(questions_collection.name)
+
+def get_stored_summary(collection_name, doc_id, summary_length="medium", summary_style="general"):
+    """Returns the precomputed summary of a document if it was made with the requested length and style."""
+    summaries_collection, count = _find_enrichment_collection(f"{collection_name}_summaries")
+    if not count:
+        return None
+    result = summaries_collection.get(ids=[doc_id], include=["documents", "metadatas"])
+    if not result or not result['documents']:
+        return None
+    metadata = result['metadatas'][0] if result['metadatas'] else {}
+    if metadata.get("summary_length") != summary_length or metadata.get("summary_style") != summary_style:
+        return None
+    return result['documents'][0]
+
+def get_stored_questions(collection_name, doc_id) -> List[str]:
+    questions_collection, count = _find_enrichment_collection(f"{collection_name}_questions")
+    if not count:
+        return []
+    result = questions_collection.get(where={"doc_id": doc_id}, include=["documents"])
+    if not result or not result['documents']:
+        return []
+    # Keep the generation order (ids are "<doc_id>-q<i>")
+    ordered = sorted(zip(result['ids'], result['documents']), key=lambda pair: int(pair[0].rsplit("-q", 1)[1]))
+    return [question for _, question in ordered]
+
+def query_questions(collection_name, query_texts, n_results=5):
+    """Searches the synthetic questions index. Returns None when the index does not exist or is empty."""
+    questions_collection, count = _find_enrichment_collection(f"{collection_name}_questions")
+    if not count:
+        return None
+    try:
+        return questions_collection.query(query_embeddings=[embed_query(text) for text in query_texts], n_results=min(n_results, count))
+    except COLLECTION_NOT_FOUND_ERRORS:
+        _forget_enrichment_collection(questions_collection.name)  # Deleted since it was looked up
+        return None
+
+# --- Parquet snapshots (ids, documents, metadata and embeddings) ---
+
+SNAPSHOT_SCHEMA = pa.schema([
+    ("id", pa.string()),
+    ("document", pa.string()),
+    ("metadata", pa.string()),  # JSON encoded, metadata keys differ between documents
+    ("embedding", pa.list_(pa.float32())),
+])
+
+def export_collection_to_parquet(collection, path, batch_size=1000):
+    """Streams a collection to a Parquet file, one row group per batch of `batch_size` documents.
+
+    Returns:
+        int: The number of exported documents.
+    """
+    schema_metadata = {
+        "collection_name": collection.name,
+        "collection_metadata": json.dumps(collection.metadata or {}),
+        "embedding_model": EMBEDDING_MODEL,
+    }
+    exported = 0
+    with pq.ParquetWriter(path, SNAPSHOT_SCHEMA.with_metadata(schema_metadata)) as writer:
+        offset = 0
+        while True:
+            batch = collection.get(limit=batch_size, offset=offset, include=["documents", "metadatas", "embeddings"])
+            if not batch['ids']:
+                break
+            embeddings = np.asarray(batch['embeddings'], dtype=np.float32)
+            offsets = np.arange(0, embeddings.size + 1, embeddings.shape[1], dtype=np.int32)
+            table = pa.Table.from_arrays([
+                pa.array(batch['ids'], pa.string()),
+                pa.array(batch['documents'], pa.string()),
+                pa.array([json.dumps(metadata) if metadata else None for metadata in batch['metadatas']], pa.string()),
+                pa.ListArray.from_arrays(pa.array(offsets), pa.array(embeddings.ravel())),
+            ], schema=SNAPSHOT_SCHEMA)
+            writer.write_table(table)
+            exported += len(batch['ids'])
+            offset += batch_size
+    return exported
+
+def read_parquet_snapshot_info(path):
+    """Returns the collection name, collection metadata and embedding model recorded in a snapshot."""
+    schema_metadata = pq.read_schema(path).metadata or {}
+    return {
+        "collection_name": schema_metadata.get(b"collection_name", b"").decode() or None,
+        "collection_metadata": json.loads(schema_metadata.get(b"collection_metadata", b"{}")),
+        "embedding_model": schema_metadata.get(b"embedding_model", b"").decode() or None,
+    }
+
+def import_collection_from_parquet(collection, path, batch_size=1000):
+    """Bulk-loads a Parquet snapshot with its precomputed embeddings, without calling the embedding model.
+
+    Returns:
+        int: The number of imported documents.
+
+    Raises:
+        ValueError: If the snapshot was embedded with a different model than the one configured.
+    """
+    snapshot_model = read_parquet_snapshot_info(path)["embedding_model"]
+    if snapshot_model and snapshot_model != EMBEDDING_MODEL:
+        raise ValueError(f"Snapshot embedded with {snapshot_model}, but the configured model is {EMBEDDING_MODEL}")
+
+    imported = 0
+    for batch in pq.ParquetFile(path).iter_batches(batch_size=batch_size):
+        embedding_column = batch.column("embedding")
+        dim = len(embedding_column[0]) if len(batch) else 0
+        embeddings = embedding_column.flatten().to_numpy(zero_copy_only=False).reshape(-1, dim)
+        collection.upsert(
+            ids=batch.column("id").to_pylist(),
+            documents=batch.column("document").to_pylist(),
+            metadatas=[json.loads(metadata) if metadata else None for metadata in batch.column("metadata").to_pylist()],
+            embeddings=embeddings.tolist(),
+        )
+        imported += len(batch)
+    return imported
+
 #Collection initialization (optional, you can do it in a separate script)
 # load_data_to_chroma() #Uncomment to load initial data
@@ -0,0 +1,185 @@
+# rag_wowinfo/event_log.py
+"""Write-behind structured log of queries and feedback.
+
+Requests only put records on an in-memory queue; a background thread batches them into rotating
+JSONL or Parquet files under the log directory. If the queue is full the record is dropped
+(and counted) instead of blocking the request.
+"""
+import json
+import os
+import queue
+import threading
+import time
+from collections import Counter
+from datetime import datetime, timezone
+from typing import Dict, Iterator, List, Optional
+
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+EVENT_LOG_FORMATS = ("jsonl", "parquet")
+# Parquet columns; the event specific fields go JSON encoded in `data`
+PARQUET_SCHEMA = pa.schema([
+    ("timestamp", pa.string()),
+    ("event", pa.string()),
+    ("query_id", pa.string()),
+    ("data", pa.string()),
+])
+_STOP = object()
+
+
+class EventLog:
+    """Background writer of event records into rotating files.
+
+    Args:
+        directory (str): The directory of the log files.
+        file_format (str): "jsonl" or "parquet".
+        batch_size (int): The maximum number of records written at once.
+        flush_interval (float): The maximum number of seconds a record waits in memory.
+        max_file_bytes (int): The size after which a new file is started.
+        max_file_seconds (float): The age after which the current file is closed and a new one is started.
+            Parquet files are only readable once closed, so this bounds how long records stay unreadable
+            (and how many a crash can lose).
+        max_queue_size (int): The number of pending records after which new records are dropped.
+    """
+
+    def __init__(self, directory: str, file_format: str = "jsonl", batch_size: int = 100, flush_interval: float = 1.0,
+                 max_file_bytes: int = 10 * 2**20, max_file_seconds: float = 300.0, max_queue_size: int = 10000):
+        if file_format not in EVENT_LOG_FORMATS:
+            raise ValueError(f"Unknown event log format: {file_format}")
+        self.directory = directory
+        self.file_format = file_format
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.max_file_bytes = max_file_bytes
+        self.max_file_seconds = max_file_seconds
+        self.dropped = 0
+        self._queue = queue.Queue(maxsize=max_queue_size)
+        self._thread = None
+        self._path = None
+        self._path_opened_at = 0.0
+        self._parquet_writer = None
+
+    def start(self):
+        if self._thread is not None:
+            return
+        os.makedirs(self.directory, exist_ok=True)
+        self._thread = threading.Thread(target=self._run, name="event-log-writer", daemon=True)
+        self._thread.start()
+
+    def log(self, event: str, query_id: Optional[str] = None, **fields):
+        """Queues a record without blocking. Dropped if the writer is not running or falls behind."""
+        if self._thread is None:
+            return
+        record = {"timestamp": datetime.now(timezone.utc).isoformat(), "event": event, "query_id": query_id, **fields}
+        try:
+            self._queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+    def close(self):
+        """Writes the pending records and stops the writer."""
+        if self._thread is None:
+            return
+        self._queue.put(_STOP)
+        self._thread.join()
+        self._thread = None
+
+    def _run(self):
+        batch: List[Dict] = []
+        deadline = time.monotonic() + self.flush_interval
+        stopping = False
+        while not stopping:
+            try:
+                record = self._queue.get(timeout=max(0.0, deadline - time.monotonic()))
+                if record is _STOP:
+                    stopping = True
+                else:
+                    batch.append(record)
+            except queue.Empty:
+                pass
+            if batch and (stopping or len(batch) >= self.batch_size or time.monotonic() >= deadline):
+                try:
+                    self._write(batch)
+                except Exception as e:  # Never let a bad batch kill the writer
+                    print(f"Event log: could not write {len(batch)} records: {e}")
+                batch = []
+            if time.monotonic() >= deadline:
+                deadline = time.monotonic() + self.flush_interval
+            if self._file_expired():
+                # Close even without new records, so an idle Parquet file gets its footer
+                self._close_file()
+                self._path = None
+        self._close_file()
+
+    def _new_path(self):
+        timestamp = datetime.now(timezone.utc).strftime("%Y%m%d-%H%M%S-%f")
+        return os.path.join(self.directory, f"events-{timestamp}.{self.file_format}")
+
+    def _file_expired(self):
+        return self._path is not None and time.monotonic() - self._path_opened_at >= self.max_file_seconds
+
+    def _rotate_if_needed(self):
+        if (self._path and os.path.exists(self._path) and os.path.getsize(self._path) < self.max_file_bytes
+                and not self._file_expired()):
+            return
+        self._close_file()
+        self._path = self._new_path()
+        self._path_opened_at = time.monotonic()
+
+    def _write(self, batch: List[Dict]):
+        self._rotate_if_needed()
+        if self.file_format == "jsonl":
+            with open(self._path, "a", encoding="utf-8") as log_file:
+                log_file.writelines(json.dumps(record, default=str) + "\n" for record in batch)
+            return
+
+        # Parquet files can't be appended to: keep the writer open and add one row group per batch
+        if self._parquet_writer is None:
+            self._parquet_writer = pq.ParquetWriter(self._path, PARQUET_SCHEMA)
+        data = [{key: value for key, value in record.items() if key not in ("timestamp", "event", "query_id")}
+                for record in batch]
+        self._parquet_writer.write_table(pa.Table.from_pydict({
+            "timestamp": [record["timestamp"] for record in batch],
+            "event": [record["event"] for record in batch],
+            "query_id": [record["query_id"] for record in batch],
+            "data": [json.dumps(fields, default=str) for fields in data],
+        }, schema=PARQUET_SCHEMA))
+
+    def _close_file(self):
+        if self._parquet_writer is not None:
+            self._parquet_writer.close()
+            self._parquet_writer = None
+
+
+def read_events(directory: str) -> Iterator[Dict]:
+    """Yields the records of every JSONL and Parquet log file in the directory, oldest file first."""
+    if not os.path.isdir(directory):
+        return
+    for name in sorted(os.listdir(directory)):
+        path = os.path.join(directory, name)
+        if name.endswith(".jsonl"):
+            with open(path, encoding="utf-8") as log_file:
+                for line in log_file:
+                    try:
+                        yield json.loads(line)
+                    except json.JSONDecodeError:
+                        continue  # Partially written last line
+        elif name.endswith(".parquet"):
+            try:
+                rows = pq.read_table(path).to_pylist()
+            except pa.ArrowInvalid:
+                continue  # File still being written (no footer yet)
+            for row in rows:
+                data = json.loads(row.pop("data") or "{}")
+                yield {**row, **data}
+
+
+def top_queries(directory: str, n: int, fields=("query",)) -> List[Dict]:
+    """Returns the `n` most frequent query events, as dictionaries of the given fields."""
+    counts = Counter(
+        tuple(event.get(field) for field in fields)
+        for event in read_events(directory)
+        if event.get("event") == "query" and event.get("query")
+    )
+    return [dict(zip(fields, values)) for values, _ in counts.most_common(n)]
@@ -0,0 +1,205 @@
+# rag_wowinfo/gazetteer.py
+"""Local entity extraction from a gazetteer of the values in the collection metadata.
+
+The values of the GAZETTEER_FIELDS metadata fields (classes, specs and, as they are added, zones,
+bosses and items) are compiled into an Aho-Corasick automaton, so matching a text costs one pass
+over it regardless of the number of entities. The entity type is the metadata field name.
+"""
+import os
+import re
+import threading
+import time
+from collections import deque
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from .sharding import get_collections
+
+GAZETTEER_FIELDS = tuple(field.strip() for field in os.environ.get("GAZETTEER_FIELDS", "class,spec,zone,boss,item").split(",") if field.strip())
+METADATA_PAGE_SIZE = 1000
+# Seconds before the gazetteer is rebuilt, so documents written by other workers, the snapshot CLI or
+# directly in ChromaDB are picked up (the admin endpoints invalidate it at once in their own process)
+GAZETTEER_TTL = float(os.environ.get("GAZETTEER_TTL", 300))
+
+# A run of capitalized words, e.g. "Ragnaros" or "Molten Core"
+_CAPITALIZED_SPAN = re.compile(r"\b[A-Z][\w'\-]*(?:\s+[A-Z][\w'\-]*)*")
+_SENTENCE_END = ".!?:"
+# Words only capitalized because they start a sentence ("What does...", "Is it...")
+_SENTENCE_INITIAL_WORDS = frozenset("""
+    A An The This That These Those It Its I My Your Our Their His Her We You They He She There Here
+    What Which Who Whom Whose When Where Why How Is Are Was Were Be Do Does Did Can Could Should Would
+    Will Shall May Might Must Has Have Had Not No Yes And But Or If So Then Also Please Tell Give Show
+    List Explain Compare In On At For With From To Of About
+""".split())
+
+
+def _fold(text: str) -> str:
+    """Lowercases the text keeping its length, so match offsets stay valid on the original text."""
+    return "".join(char.lower() if len(char.lower()) == 1 else char for char in text)
+
+
+class Gazetteer:
+    """Aho-Corasick automaton matching known entities case-insensitively on word boundaries."""
+
+    def __init__(self):
+        self._goto: List[Dict[str, int]] = [{}]
+        self._fail: List[int] = [0]
+        self._outputs: List[List[int]] = [[]]
+        self._entries: List[Tuple[str, str, int]] = []  # (entity, type, length)
+        self._seen = set()
+        self._built = False
+
+    def __len__(self):
+        return len(self._entries)
+
+    def add(self, entity: str, entity_type: str):
+        entity = entity.strip()
+        if not entity or (entity.lower(), entity_type) in self._seen:
+            return
+        self._seen.add((entity.lower(), entity_type))
+        state = 0
+        for char in _fold(entity):
+            if char not in self._goto[state]:
+                self._goto.append({})
+                self._fail.append(0)
+                self._outputs.append([])
+                self._goto[state][char] = len(self._goto) - 1
+            state = self._goto[state][char]
+        self._outputs[state].append(len(self._entries))
+        self._entries.append((entity, entity_type, len(entity)))
+        self._built = False
+
+    def build(self):
+        """Computes the failure links (breadth-first), required before matching."""
+        queue = deque()
+        for state in self._goto[0].values():
+            self._fail[state] = 0
+            queue.append(state)
+        while queue:
+            state = queue.popleft()
+            for char, next_state in self._goto[state].items():
+                queue.append(next_state)
+                fail = self._fail[state]
+                while fail and char not in self._goto[fail]:
+                    fail = self._fail[fail]
+                self._fail[next_state] = self._goto[fail].get(char, 0)
+                self._outputs[next_state] = self._outputs[next_state] + self._outputs[self._fail[next_state]]
+        self._built = True
+        return self
+
+    def find(self, text: str) -> List[Dict]:
+        """Returns the non-overlapping matches (leftmost, then longest) as {"entity", "type", "start", "end"}."""
+        if not self._built:
+            self.build()
+        candidates = []
+        state = 0
+        for position, char in enumerate(_fold(text)):
+            while state and char not in self._goto[state]:
+                state = self._fail[state]
+            state = self._goto[state].get(char, 0)
+            for entry in self._outputs[state]:
+                entity, entity_type, length = self._entries[entry]
+                start, end = position - length + 1, position + 1
+                if (start == 0 or not text[start - 1].isalnum()) and (end == len(text) or not text[end].isalnum()):
+                    candidates.append((start, end, entity, entity_type))
+
+        matches = []
+        covered_until = 0
+        for start, end, entity, entity_type in sorted(candidates, key=lambda match: (match[0], -match[1])):
+            if start < covered_until:
+                # Same span as the previous match (an entity with several types) or overlapping it
+                if matches and (start, end) == (matches[-1]["start"], matches[-1]["end"]):
+                    matches.append({"entity": entity, "type": entity_type, "start": start, "end": end})
+                continue
+            matches.append({"entity": entity, "type": entity_type, "start": start, "end": end})
+            covered_until = end
+        return matches
+
+
+def build_gazetteer(metadatas: Iterable[Optional[Dict]], fields: Iterable[str] = GAZETTEER_FIELDS) -> Gazetteer:
+    gazetteer = Gazetteer()
+    fields = tuple(fields)
+    for metadata in metadatas:
+        for field in fields:
+            value = (metadata or {}).get(field)
+            if isinstance(value, str):
+                gazetteer.add(value, field)
+    return gazetteer.build()
+
+
+def _at_sentence_start(text: str, position: int) -> bool:
+    """Whether only whitespace separates `position` from the start of the text or a sentence end."""
+    index = position - 1
+    while index >= 0 and text[index].isspace():
+        if text[index] == "\n":
+            return True
+        index -= 1
+    return index < 0 or (index < position - 1 and text[index] in _SENTENCE_END)
+
+
+def unmatched_capitalized_spans(text: str, matches: List[Dict]) -> List[str]:
+    """Returns the capitalized spans left once the matches are removed, likely entities the gazetteer doesn't know.
+
+    In "Is Holy Paladin good?" with only "Holy" known, "Paladin" is returned, and "Stormwind is nice"
+    returns "Stormwind". Common words that are only capitalized because they start a sentence
+    ("The", "What", "Is") are left out.
+    """
+    ranges = sorted((match["start"], match["end"]) for match in matches)
+    spans = []
+    first_range = 0
+    for span in _CAPITALIZED_SPAN.finditer(text):
+        while first_range < len(ranges) and ranges[first_range][1] <= span.start():
+            first_range += 1  # Spans come in order, earlier ranges can't overlap the next ones
+        # Cut the matched ranges out of the span and look for capitalized words in what is left
+        pieces, cursor = [], span.start()
+        index = first_range
+        while index < len(ranges) and ranges[index][0] < span.end():
+            pieces.append((cursor, max(cursor, ranges[index][0])))
+            cursor = max(cursor, ranges[index][1])
+            index += 1
+        pieces.append((cursor, span.end()))
+
+        for piece_start, piece_end in pieces:
+            for rest in _CAPITALIZED_SPAN.finditer(text, piece_start, piece_end):
+                words = rest.group()
+                if _at_sentence_start(text, rest.start()):
+                    first, *remainder = words.split(None, 1)
+                    if first in _SENTENCE_INITIAL_WORDS:
+                        words = remainder[0] if remainder else ""
+                if words and words != "I":
+                    spans.append(words)
+    return spans
+
+
+# --- Gazetteer of the knowledge base, rebuilt lazily after the documents change ---
+
+_gazetteer: Optional[Gazetteer] = None
+_gazetteer_built_at = 0.0  # time.monotonic() of the last build
+_gazetteer_lock = threading.Lock()
+
+
+def _collection_metadatas(collection_name: str):
+    for collection in get_collections(collection_name):
+        offset = 0
+        while True:
+            page = collection.get(limit=METADATA_PAGE_SIZE, offset=offset, include=["metadatas"])
+            if not page['ids']:
+                break
+            yield from page['metadatas']
+            offset += METADATA_PAGE_SIZE
+
+
+def get_gazetteer(collection_name: str = "wowinfo") -> Gazetteer:
+    """Returns the gazetteer of the collection metadata, rebuilt on first use after an invalidation or GAZETTEER_TTL seconds."""
+    global _gazetteer, _gazetteer_built_at
+    with _gazetteer_lock:
+        if _gazetteer is None or time.monotonic() - _gazetteer_built_at >= GAZETTEER_TTL:
+            _gazetteer = build_gazetteer(_collection_metadatas(collection_name))
+            _gazetteer_built_at = time.monotonic()
+        return _gazetteer
+
+
+def invalidate_gazetteer():
+    """Marks the gazetteer as stale, to be called whenever documents are added, updated or deleted."""
+    global _gazetteer
+    with _gazetteer_lock:
+        _gazetteer = None
@@ -1,10 +1,14 @@
 # rag_wowinfo/main.py
 import os
+import re
+from concurrent.futures import ThreadPoolExecutor
 from typing import List, Dict
 import google.generativeai as genai
 from dotenv import load_dotenv
-from .database import get_collection, query_chroma, add_document_to_chroma, update_document_in_chroma, delete_document_from_chroma, get_document_by_id
-from .utils import clean_text, chunk_text, is_valid_url, get_url_content
+from .database import embed_query, get_collection, query_chroma, add_document_to_chroma, update_document_in_chroma, delete_document_from_chroma, get_document_by_id, query_questions
+from .sharding import retrieve, get_documents
+from .gazetteer import get_gazetteer, unmatched_capitalized_spans
+from .utils import clean_text, chunk_text, is_valid_url, get_url_content, LRUCache
 from typing import Optional, List
 import httpx #To make requests to URLs asynchronously
 
@@ -16,6 +20,16 @@ genai.configure(api_key=gemini_api_key)
 # gemini-1.5-pro-002
 MODEL_NAME = 'gemini-1.5-pro-002'
 model = genai.GenerativeModel(MODEL_NAME)
+# Number of synthetic questions generated per document by the enrichment stage
+ENRICHMENT_NUM_QUESTIONS = int(os.environ.get("ENRICHMENT_NUM_QUESTIONS", 5))
+# Bullet or numbering at the start of a generated line ("- ", "3. ", "2) ")
+_LIST_MARKER = re.compile(r"^\s*(?:[-*]|\d+[.)])\s*")
+# Answers of answer_question by arguments. The admin endpoints clear it when they change documents, but
+# only in their own process: the TTL bounds how long other workers, the snapshot CLI or direct ChromaDB
+# writes can leave stale answers.
+answer_cache = LRUCache(int(os.environ.get("ANSWER_CACHE_SIZE", 1024)), ttl=float(os.environ.get("ANSWER_CACHE_TTL", 300)))
+# Searches the synthetic questions index while the documents are retrieved
+_questions_executor = ThreadPoolExecutor(max_workers=int(os.environ.get("MAX_FANOUT_WORKERS", 8)), thread_name_prefix="questions-query")
 
 # --- Principal functions of RAG system ---
 
@@ -36,13 +50,20 @@ def answer_question(collection_name: str, query: str, num_results: int = 5, crea
     Returns:
         Dict: A dictionary containing the answer and a list of sources.
     """
-    collection = get_collection(collection_name)
-    results = query_chroma(collection, [query], n_results=num_results)
+    cache_key = (collection_name, query, num_results, creativity, max_length, response_format, additional_context)
+    cached = answer_cache.get(cache_key)
+    if cached is not None:
+        return cached
+
+    embed_query(query)  # Embedded once here, both searches below reuse the cached embedding
+    question_results = _questions_executor.submit(query_questions, collection_name, [query], n_results=num_results)
+    results = retrieve(collection_name, query, n_results=num_results)
+    results = merge_question_matches(collection_name, results, question_results.result(), num_results)
 
     if not results or not results['documents'] or not results['documents'][0]:
         return {"answer": "No relevant information was found.", "sources": []}
 
-    context_list = results['documents'][0]
+    context_list = list(results['documents'][0])
     metadatas = results['metadatas'][0] if results['metadatas'] else []
 
     # Add the context if provided
@@ -65,8 +86,79 @@ def answer_question(collection_name: str, query: str, num_results: int = 5, crea
     answer = response.text
     if max_length:
         answer = answer[:max_length]
-    sources = [{"document": doc, "metadata": metadata} for doc, metadata in zip(results['documents'][0], metadatas)]
-    return {"answer": answer, "sources": sources}
+    sources = [{"id": doc_id, "document": doc, "metadata": metadata}
+               for doc_id, doc, metadata in zip(results['ids'][0], results['documents'][0], metadatas)]
+    result = {"answer": answer, "sources": sources}
+    answer_cache.set(cache_key, result)
+    return result
+
+def merge_question_matches(collection_name: str, results: Dict, question_results: Optional[Dict], num_results: int):
+    """Merges documents whose synthetic questions match the query into the direct retrieval results.
+
+    Both indexes use the same embedding function, so distances are comparable: each document keeps
+    its best distance and the top `num_results` are returned in the same shape as `collection.query`.
+
+    Args:
+        collection_name (str): The name of the ChromaDB collection holding the documents.
+        results (Dict): The results of querying the documents directly.
+        question_results (Optional[Dict]): The results of database.query_questions for the same query, None if there is no questions index.
+        num_results (int): The number of documents to keep.
+
+    Returns:
+        Dict: The merged results.
+    """
+    if not question_results or not question_results['ids'] or not question_results['ids'][0]:
+        return results
+
+    best = {}  # doc_id -> distance
+    if results and results['ids'] and results['ids'][0]:
+        for doc_id, distance in zip(results['ids'][0], results['distances'][0]):
+            best[doc_id] = distance
+    for metadata, distance in zip(question_results['metadatas'][0], question_results['distances'][0]):
+        doc_id = metadata["doc_id"]
+        if distance < best.get(doc_id, float("inf")):
+            best[doc_id] = distance
+
+    top_ids = sorted(best, key=best.get)[:num_results]
+    known = {}
+    if results and results['ids'] and results['ids'][0]:
+        for doc_id, document, metadata in zip(results['ids'][0], results['documents'][0], results['metadatas'][0]):
+            known[doc_id] = (document, metadata)
+    missing = [doc_id for doc_id in top_ids if doc_id not in known]
+    if missing:
+        fetched = get_documents(collection_name, missing)
+        for doc_id, document, metadata in zip(fetched['ids'], fetched['documents'], fetched['metadatas']):
+            known[doc_id] = (document, metadata)
+
+    top_ids = [doc_id for doc_id in top_ids if doc_id in known]
+    return {
+        "ids": [top_ids],
+        "documents": [[known[doc_id][0] for doc_id in top_ids]],
+        "metadatas": [[known[doc_id][1] for doc_id in top_ids]],
+        "distances": [[best[doc_id] for doc_id in top_ids]],
+    }
+
+def generate_enrichment(document_text: str, num_questions: int = ENRICHMENT_NUM_QUESTIONS):
+    """Generates the summary and synthetic questions stored for a document at ingest time.
+
+    Args:
+        document_text (str): The text of the document.
+        num_questions (int, optional): The number of questions to generate. Defaults to ENRICHMENT_NUM_QUESTIONS.
+
+    Returns:
+        Dict: A dictionary with the "summary" (str) and the "questions" (List[str]).
+    """
+    summary_prompt = f"Summarize the following text in a medium length, general style: {document_text}"
+    summary = model.generate_content(summary_prompt).text
+
+    questions_prompt = f"""Generate {num_questions} questions that the following text answers.
+    Write one question per line, without numbering:
+    {document_text}
+    """
+    response = model.generate_content(questions_prompt)
+    questions = [_LIST_MARKER.sub("", line).strip() for line in response.text.split("\n")]
+    questions = [question for question in questions if question][:num_questions]
+    return {"summary": summary, "questions": questions}
 
 async def summarize_content(document_text: str, summary_length: str = "medium", summary_style: str = "general"):
     """Summarizes a given text.
@@ -116,8 +208,7 @@ async def translate_with_context(text: str, target_language: str, num_results:in
         str: The translated text.
     """
     #First, RAG retrieval.
-    collection = get_collection() #We obtain the default collection
-    results = query_chroma(collection, [text], n_results=num_results)
+    results = retrieve("wowinfo", text, n_results=num_results) #We query the default collection
 
     context_list = results['documents'][0] if (results and results['documents']) else []
 
@@ -212,6 +303,34 @@ async def extract_entities_from_text(text: str):
 
     return entities
 
+async def extract_entities(text: str, use_llm: bool = False):
+    """Extracts named entities, matching the knowledge base gazetteer locally before falling back to the LLM.
+
+    The LLM is only called if the text has capitalized spans the gazetteer doesn't know, or if `use_llm` is set.
+
+    Args:
+        text (str): The text to extract entities from.
+        use_llm (bool, optional): Whether to always ask the LLM too. Defaults to False.
+
+    Returns:
+        List[Dict]: A list of dictionaries, where each dictionary contains an entity and its type.
+    """
+    matches = get_gazetteer().find(text)
+    entities = []
+    seen = set()
+    for match in matches:
+        if (match["entity"].lower(), match["type"]) not in seen:
+            seen.add((match["entity"].lower(), match["type"]))
+            entities.append({"entity": match["entity"], "type": match["type"]})
+
+    if use_llm or unmatched_capitalized_spans(text, matches):
+        known = {entity.lower() for entity, _ in seen}
+        for entity in await extract_entities_from_text(text):
+            if entity["entity"].lower() not in known:
+                known.add(entity["entity"].lower())
+                entities.append(entity)
+    return entities
+
 
 
 # --- Auxiliary functions (could go in utils.py) ---
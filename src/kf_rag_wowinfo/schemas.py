@@ -3,12 +3,16 @@ from typing import Optional, List, Dict
 from pydantic import BaseModel, Field, field_validator
 
 class Source(BaseModel):
-    document: str
-    metadata: Dict[str, str]
+    # Fields left out by the requested sources projection are omitted from the response
+    id: Optional[str] = None
+    document: Optional[str] = None
+    snippet: Optional[str] = None
+    metadata: Optional[Dict[str, str]] = None
 
 class QueryResponse(BaseModel):
     answer: str
     sources: List[Source]
+    query_id: Optional[str] = None  # Pass it to /feedback to rate this answer
 
 class Feedback(BaseModel):
     query_id: str
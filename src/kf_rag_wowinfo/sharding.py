@@ -0,0 +1,283 @@
+# rag_wowinfo/sharding.py
+"""Splits the knowledge base into one collection per value of a metadata field (e.g. `class` or a content type).
+
+Sharding is enabled by setting SHARD_KEY to the metadata field. Each shard is the collection
+"<collection_name>--<value>", whose metadata records the shard key and value so the shards can be
+discovered from ChromaDB. Queries that mention shard values (e.g. "mage") only search those shards;
+the rest fan out to every shard concurrently and the results are merged by distance.
+
+Without SHARD_KEY every function here works on the single collection, as before.
+"""
+import os
+import re
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Optional
+
+from .database import (client, embed_query, index_metadata, get_collection, find_collection, query_chroma,
+                       read_csv_documents, update_document_in_chroma, enrich_documents, delete_enrichment, Enricher,
+                       COLLECTION_NOT_FOUND_ERRORS)
+
+SHARD_KEY = os.environ.get("SHARD_KEY") or None
+SHARD_SEPARATOR = "--"
+MAX_FANOUT_WORKERS = int(os.environ.get("MAX_FANOUT_WORKERS", 8))
+# Seconds before the shard list is rediscovered, so shards created by other workers are picked up
+SHARD_LIST_TTL = float(os.environ.get("SHARD_LIST_TTL", 60))
+
+_executor = ThreadPoolExecutor(max_workers=MAX_FANOUT_WORKERS, thread_name_prefix="shard-query")
+_shards_lock = threading.Lock()
+_shards: Dict[str, Dict[str, str]] = {}  # collection_name -> {shard collection name: shard value}
+_shards_listed_at: Dict[str, float] = {}  # collection_name -> time.monotonic() of the last discovery
+_handles: Dict = {}  # shard collection name -> Collection, saves a get_collection round-trip per query
+
+
+def shard_collection_name(collection_name: str, shard_value) -> str:
+    slug = re.sub(r"[^a-zA-Z0-9]+", "_", str(shard_value)).strip("_").lower() or "unknown"
+    return f"{collection_name}{SHARD_SEPARATOR}{slug}"
+
+
+def get_shard(collection_name: str, shard_value):
+    """Gets or creates the shard of a value, recording the shard key and value in its metadata."""
+    shard_metadata = dict(index_metadata, shard_key=SHARD_KEY, shard_value=str(shard_value))
+    shard = get_collection(shard_collection_name(collection_name, shard_value), index_settings=shard_metadata)
+    with _shards_lock:
+        _handles[shard.name] = shard
+        if collection_name in _shards:
+            _shards[collection_name][shard.name] = str(shard_value)
+    return shard
+
+
+def _shard_handle(name: str):
+    """Returns the cached collection of a shard, or None if the shard no longer exists."""
+    with _shards_lock:
+        shard = _handles.get(name)
+    if shard is None:
+        shard = find_collection(name)
+        if shard is not None:
+            with _shards_lock:
+                _handles[name] = shard
+    return shard
+
+
+def _forget_shard(name: str):
+    """Drops a shard that disappeared from the caches; the next discovery finds it again if it was recreated."""
+    with _shards_lock:
+        _handles.pop(name, None)
+        for shards in _shards.values():
+            shards.pop(name, None)
+
+
+def list_shards(collection_name: str = "wowinfo", refresh: bool = False) -> Dict[str, str]:
+    """Returns {shard collection name: shard value}, discovered from ChromaDB and cached for SHARD_LIST_TTL seconds."""
+    with _shards_lock:
+        fresh = time.monotonic() - _shards_listed_at.get(collection_name, float("-inf")) < SHARD_LIST_TTL
+        if collection_name in _shards and fresh and not refresh:
+            return dict(_shards[collection_name])
+
+    prefix = f"{collection_name}{SHARD_SEPARATOR}"
+    shards = {}
+    for listed in client.list_collections():
+        name = getattr(listed, "name", listed)  # Older ChromaDB versions list names only
+        if not name.startswith(prefix):
+            continue
+        metadata = getattr(listed, "metadata", None) or client.get_collection(name).metadata or {}
+        shards[name] = metadata.get("shard_value", name[len(prefix):])
+
+    with _shards_lock:
+        _shards[collection_name] = shards
+        _shards_listed_at[collection_name] = time.monotonic()
+    return dict(shards)
+
+
+def route_query(collection_name: str, query: str) -> List[str]:
+    """Returns the shards whose value is mentioned in the query, or every shard if none is."""
+    shards = list_shards(collection_name)
+    normalized_query = query.lower()
+    matched = []
+    for name, shard_value in shards.items():
+        term = re.sub(r"[_\-]+", " ", shard_value.lower()).strip()
+        if term and re.search(rf"\b{re.escape(term)}s?\b", normalized_query):
+            matched.append(name)
+    return matched or list(shards)
+
+
+def _merge_by_distance(results: List[Dict], n_results: int) -> Dict:
+    """Merges single-query results of several collections into the top `n_results` by distance."""
+    rows = []
+    for result in results:
+        if not result or not result['ids'] or not result['ids'][0]:
+            continue
+        rows.extend(zip(result['distances'][0], result['ids'][0], result['documents'][0], result['metadatas'][0]))
+    rows.sort(key=lambda row: row[0])
+    rows = rows[:n_results]
+    return {
+        "ids": [[row[1] for row in rows]],
+        "documents": [[row[2] for row in rows]],
+        "metadatas": [[row[3] for row in rows]],
+        "distances": [[row[0] for row in rows]],
+    }
+
+
+def query_shards(collection_name: str, query: str, n_results: int = 5) -> Dict:
+    """Queries the shards routed for the query concurrently, embedding the query only once."""
+    shard_names = route_query(collection_name, query)
+    if not shard_names:
+        return {"ids": [[]], "documents": [[]], "metadatas": [[]], "distances": [[]]}
+    query_embeddings = [embed_query(query)]
+
+    def query_shard(name):
+        # A shard deleted since it was listed counts as empty instead of failing the whole query
+        shard = _shard_handle(name)
+        if shard is None:
+            return None
+        try:
+            return shard.query(query_embeddings=query_embeddings, n_results=n_results)
+        except COLLECTION_NOT_FOUND_ERRORS:
+            _forget_shard(name)
+            return None
+
+    return _merge_by_distance(list(_executor.map(query_shard, shard_names)), n_results)
+
+
+def retrieve(collection_name: str, query: str, n_results: int = 5) -> Dict:
+    """Retrieves the closest documents to a query, from the shards if sharding is enabled."""
+    if SHARD_KEY:
+        return query_shards(collection_name, query, n_results)
+    return query_chroma(get_collection(collection_name), [query], n_results=n_results)
+
+
+def get_documents(collection_name: str, ids: List[str]) -> Dict:
+    """Gets documents by id (in the shape of `collection.get`), looking in every shard if sharding is enabled."""
+    if not SHARD_KEY:
+        return get_collection(collection_name).get(ids=ids, include=["documents", "metadatas"])
+
+    def get_from_shard(name):
+        shard = _shard_handle(name)
+        if shard is None:
+            return None
+        try:
+            return shard.get(ids=ids, include=["documents", "metadatas"])
+        except COLLECTION_NOT_FOUND_ERRORS:
+            _forget_shard(name)
+            return None
+
+    merged = {"ids": [], "documents": [], "metadatas": []}
+    for result in _executor.map(get_from_shard, list_shards(collection_name)):
+        if result is None:
+            continue
+        for key in merged:
+            merged[key].extend(result[key])
+    return merged
+
+
+def get_collections(collection_name: str) -> List:
+    """Returns every collection holding documents: the shards if sharding is enabled, else the single collection."""
+    if not SHARD_KEY:
+        return [get_collection(collection_name)]
+    shards = [_shard_handle(name) for name in list_shards(collection_name)]
+    return [shard for shard in shards if shard is not None]
+
+
+def find_document_collection(collection_name: str, doc_id: str):
+    """Returns the collection (shard or single collection) holding a document, or None if it does not exist."""
+    if not SHARD_KEY:
+        collection = get_collection(collection_name)
+        return collection if collection.get(ids=[doc_id], include=[])['ids'] else None
+    for shard in get_collections(collection_name):
+        try:
+            if shard.get(ids=[doc_id], include=[])['ids']:
+                return shard
+        except COLLECTION_NOT_FOUND_ERRORS:
+            _forget_shard(shard.name)
+    return None
+
+
+def find_document(collection_name: str, doc_id: str) -> Optional[Dict]:
+    """Gets a document and its metadata by id, in the format of database.get_document_by_id."""
+    result = get_documents(collection_name, [doc_id])
+    if not result['ids']:
+        return None
+    return {"document": result['documents'][0], "metadata": result['metadatas'][0]}
+
+
+def collection_for_metadata(collection_name: str, metadata: Optional[Dict]):
+    """Returns the collection a document with this metadata belongs to."""
+    if not SHARD_KEY:
+        return get_collection(collection_name)
+    return get_shard(collection_name, (metadata or {}).get(SHARD_KEY, "unknown"))
+
+
+def update_document(collection_name: str, doc_id: str, document: Optional[str] = None, metadata: Optional[Dict] = None) -> bool:
+    """Updates a document, moving it to another shard if the metadata changes its SHARD_KEY value.
+
+    As with a ChromaDB update, the given metadata is merged into the existing one.
+
+    Returns:
+        bool: False if the document does not exist.
+    """
+    collection = find_document_collection(collection_name, doc_id)
+    if collection is None:
+        return False
+    if SHARD_KEY and metadata and SHARD_KEY in metadata:
+        target_name = shard_collection_name(collection_name, metadata[SHARD_KEY])
+        if target_name != collection.name:
+            current = collection.get(ids=[doc_id], include=["documents", "metadatas"])
+            merged_metadata = {**(current['metadatas'][0] or {}), **metadata}
+            target = get_shard(collection_name, metadata[SHARD_KEY])
+            target.add(documents=[document or current['documents'][0]], metadatas=[merged_metadata], ids=[doc_id])
+            collection.delete(ids=[doc_id])
+            return True
+
+    update_document_in_chroma(collection, doc_id, document, metadata)
+    return True
+
+
+def delete_document(collection_name: str, doc_id: str):
+    collection = find_document_collection(collection_name, doc_id)
+    if collection is not None:
+        collection.delete(ids=[doc_id])
+    delete_enrichment(collection_name, doc_id)
+
+
+def load_data_to_shards(csv_path="data/wow_data.csv", collection_name="wowinfo", enricher: Optional[Enricher] = None,
+                        shard_value=None):
+    """Loads the CSV into one shard per SHARD_KEY value. If `shard_value` is given, only that shard is rebuilt.
+
+    Returns:
+        Tuple[List[str], List[str]]: The names of the loaded shards and the ids of the documents whose enrichment failed.
+    """
+    ids, documents, metadatas = read_csv_documents(csv_path)
+    groups: Dict[str, List[int]] = {}
+    for index, metadata in enumerate(metadatas):
+        value = str(metadata.get(SHARD_KEY, "unknown"))
+        if shard_value is None or value == str(shard_value):
+            groups.setdefault(value, []).append(index)
+
+    loaded, failed = [], []
+    for value, indexes in groups.items():
+        name = shard_collection_name(collection_name, value)
+        shard = get_shard(collection_name, value)
+        shard_ids = [ids[i] for i in indexes]
+        shard.upsert(
+            documents=[documents[i] for i in indexes],
+            metadatas=[metadatas[i] for i in indexes],
+            ids=shard_ids
+        )
+        if shard_value is not None:
+            # Rebuilt in place (upsert first, then drop what is no longer in the CSV) so concurrent queries
+            # never see the shard missing or empty. The other shards only lose copies of these documents.
+            stale_ids = set(shard.get(include=[])['ids']) - set(shard_ids)
+            if stale_ids:
+                shard.delete(ids=list(stale_ids))
+                for doc_id in stale_ids:
+                    delete_enrichment(collection_name, doc_id)
+            for other in get_collections(collection_name):
+                if other.name != name:
+                    other.delete(ids=shard_ids)
+        if enricher:
+            failed += enrich_documents(collection_name, [ids[i] for i in indexes], [documents[i] for i in indexes], enricher)
+        loaded.append(name)
+
+    list_shards(collection_name, refresh=True)
+    return loaded, failed
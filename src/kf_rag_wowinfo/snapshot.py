@@ -0,0 +1,66 @@
+# rag_wowinfo/snapshot.py
+"""Exports and imports ChromaDB collections as Parquet snapshots.
+
+Usage:
+    python -m kf_rag_wowinfo.snapshot export snapshots/wowinfo.parquet --collection wowinfo
+    python -m kf_rag_wowinfo.snapshot import snapshots/wowinfo.parquet
+"""
+import argparse
+from .database import get_collection, find_collection, export_collection_to_parquet, import_collection_from_parquet, read_parquet_snapshot_info
+
+
+def export_snapshot(path, collection_name="wowinfo", batch_size=1000):
+    """Exports a collection to a Parquet snapshot. Returns the number of exported documents.
+
+    Raises:
+        LookupError: If the collection does not exist.
+    """
+    collection = find_collection(collection_name)
+    if collection is None:
+        raise LookupError(f"Collection not found: {collection_name}")
+    return export_collection_to_parquet(collection, path, batch_size)
+
+
+def import_snapshot(path, collection_name=None, batch_size=1000):
+    """Imports a Parquet snapshot into a collection, by default the one it was exported from.
+
+    A collection that does not exist yet is created with the index settings recorded in the snapshot.
+
+    Returns:
+        Dict: The name of the collection and the number of imported documents.
+    """
+    info = read_parquet_snapshot_info(path)
+    collection_name = collection_name or info["collection_name"] or "wowinfo"
+    collection = get_collection(collection_name, index_settings=info["collection_metadata"] or None)
+    imported = import_collection_from_parquet(collection, path, batch_size)
+    return {"collection_name": collection_name, "imported": imported}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Export or import ChromaDB collections as Parquet snapshots.")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    export_parser = subparsers.add_parser("export", help="Export a collection to a Parquet file")
+    export_parser.add_argument("path")
+    export_parser.add_argument("--collection", default="wowinfo")
+    export_parser.add_argument("--batch-size", type=int, default=1000, help="Documents per row group")
+
+    import_parser = subparsers.add_parser("import", help="Import a Parquet file into a collection")
+    import_parser.add_argument("path")
+    import_parser.add_argument("--collection", help="Target collection (default: the exported one)")
+    import_parser.add_argument("--batch-size", type=int, default=1000, help="Documents per upsert")
+
+    args = parser.parse_args()
+    if args.command == "export":
+        try:
+            exported = export_snapshot(args.path, args.collection, args.batch_size)
+        except LookupError as e:
+            parser.exit(1, f"{e}\n")
+        print(f"Exported {exported} documents from {args.collection} to {args.path}")
+    else:
+        result = import_snapshot(args.path, args.collection, args.batch_size)
+        print(f"Imported {result['imported']} documents from {args.path} into {result['collection_name']}")
+
+
+if __name__ == "__main__":
+    main()
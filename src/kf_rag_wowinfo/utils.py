@@ -1,6 +1,9 @@
 # rag_wowinfo/utils.py
 import re
-from typing import List
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, Hashable, List, Optional
 from urllib.parse import urlparse
 import httpx
 
@@ -24,6 +27,86 @@ def chunk_text(text: str, chunk_size: int, overlap: int) -> List[str]:
     return chunks
 
 
+class LRUCache:
+    """Thread-safe least-recently-used cache with a maximum number of entries.
+
+    With `ttl` (seconds), entries also expire that long after they were set.
+    """
+
+    def __init__(self, maxsize: int = 1024, ttl: Optional[float] = None):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data = OrderedDict()  # key -> (value, expiry time or None)
+        self._lock = threading.Lock()
+
+    def get(self, key: Hashable, default=None):
+        with self._lock:
+            if key not in self._data:
+                return default
+            value, expires_at = self._data[key]
+            if expires_at is not None and time.monotonic() >= expires_at:
+                del self._data[key]
+                return default
+            self._data.move_to_end(key)
+            return value
+
+    def set(self, key: Hashable, value):
+        if self.maxsize <= 0:
+            return
+        expires_at = time.monotonic() + self.ttl if self.ttl else None
+        with self._lock:
+            self._data[key] = (value, expires_at)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self):
+        return len(self._data)
+
+
+INDEX_SPACES = ("l2", "cosine", "ip")
+
+def build_index_metadata(space: Optional[str] = None, m: Optional[int] = None,
+                         construction_ef: Optional[int] = None, search_ef: Optional[int] = None) -> Dict:
+    """Builds the ChromaDB collection metadata that configures the vector index.
+
+    Settings left as None are omitted so ChromaDB keeps its defaults.
+    """
+    if space is not None and space not in INDEX_SPACES:
+        raise ValueError(f"Unknown distance metric: {space}")
+    settings = {
+        "hnsw:space": space,
+        "hnsw:M": m,
+        "hnsw:construction_ef": construction_ef,
+        "hnsw:search_ef": search_ef,
+    }
+    return {key: value for key, value in settings.items() if value is not None}
+
+
+SOURCE_PROJECTIONS = ("ids", "metadata", "snippets", "full")
+
+def project_sources(sources: List[Dict], projection: str = "full", snippet_length: int = 200) -> List[Dict]:
+    """Keeps only the fields of each source requested by the projection.
+
+    "ids" keeps the id, "metadata" adds the metadata, "snippets" adds the first
+    `snippet_length` characters of the document and "full" returns the whole document.
+    """
+    if projection not in SOURCE_PROJECTIONS:
+        raise ValueError(f"Unknown sources projection: {projection}")
+    if projection == "ids":
+        return [{"id": source.get("id")} for source in sources]
+    if projection == "metadata":
+        return [{"id": source.get("id"), "metadata": source.get("metadata")} for source in sources]
+    if projection == "snippets":
+        return [{"id": source.get("id"), "metadata": source.get("metadata"),
+                 "snippet": (source.get("document") or "")[:snippet_length]} for source in sources]
+    return sources
+
+
 def is_valid_url(url):
     try:
         result = urlparse(url)